@@ -0,0 +1,37 @@
+from logging.config import fileConfig
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from alembic import context
+from app.db.database import Base, engine, SYNC_DATABASE_URL
+import app.db.models  # noqa: F401  (registers tables on Base.metadata)
+
+config = context.config
+
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+target_metadata = Base.metadata
+
+def run_migrations_offline():
+    """Emits the migration SQL without connecting (alembic upgrade head --sql)."""
+    context.configure(
+        url=SYNC_DATABASE_URL.render_as_string(hide_password=False),
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+def run_migrations_online():
+    with engine.connect() as connection:
+        context.configure(connection=connection, target_metadata=target_metadata)
+        with context.begin_transaction():
+            context.run_migrations()
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,117 @@
+"""initial schema
+
+Creates the pgvector extension, all tables and the search indexes. Databases that
+were bootstrapped by the former init_db() (create_all on every startup) are
+upgraded in place instead of recreated.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-15
+"""
+from alembic import context, op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+from pgvector.sqlalchemy import HALFVEC
+
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def _column_type(table, column):
+    return op.get_bind().execute(sa.text(
+        "SELECT format_type(atttypid, atttypmod) FROM pg_attribute "
+        "WHERE attrelid = CAST(:table AS regclass) AND attname = :column"
+    ), {"table": table, "column": column}).scalar()
+
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS vector")
+
+    # Offline (--sql) scripts target an empty database
+    legacy = not context.is_offline_mode()
+    existing = set(sa.inspect(op.get_bind()).get_table_names()) if legacy else set()
+
+    if "documents" not in existing:
+        op.create_table(
+            "documents",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("title", sa.String()),
+            sa.Column("category", sa.String()),
+            sa.Column("tags", postgresql.JSONB()),
+            sa.Column("source", sa.String()),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        )
+        op.create_index("ix_documents_id", "documents", ["id"])
+        op.create_index("ix_documents_title", "documents", ["title"])
+        op.create_index("ix_documents_category", "documents", ["category"])
+
+    if "chunks" not in existing:
+        op.create_table(
+            "chunks",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("document_id", sa.Integer(), sa.ForeignKey("documents.id")),
+            sa.Column("chunk_index", sa.Integer()),
+            sa.Column("chunk_text", sa.Text()),
+            sa.Column("embedding", HALFVEC(1536)),
+            sa.Column("metadata", sa.JSON()),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        )
+        op.create_index("ix_chunks_id", "chunks", ["id"])
+
+    if "tickets" not in existing:
+        op.create_table(
+            "tickets",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("mode", sa.String()),
+            sa.Column("question", sa.Text()),
+            sa.Column("context", sa.JSON()),
+            sa.Column("answer", sa.Text(), nullable=True),
+            sa.Column("category", sa.String(), nullable=True),
+            sa.Column("sources", sa.JSON()),
+            sa.Column("latency_ms", sa.Float(), nullable=True),
+            sa.Column("token_usage", sa.JSON(), nullable=True),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        )
+        op.create_index("ix_tickets_id", "tickets", ["id"])
+        op.create_index("ix_tickets_mode", "tickets", ["mode"])
+
+    if "tool_logs" not in existing:
+        op.create_table(
+            "tool_logs",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("ticket_id", sa.Integer(), sa.ForeignKey("tickets.id")),
+            sa.Column("step", sa.Integer()),
+            sa.Column("tool_name", sa.String()),
+            sa.Column("tool_input", sa.JSON()),
+            sa.Column("tool_output", sa.Text()),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        )
+        op.create_index("ix_tool_logs_id", "tool_logs", ["id"])
+
+    # Legacy schemas: untyped vector embeddings and JSON tags
+    if legacy and _column_type("chunks", "embedding") != "halfvec(1536)":
+        # The index operator class depends on the column type
+        op.execute("DROP INDEX IF EXISTS idx_chunks_embedding_hnsw")
+        op.execute("ALTER TABLE chunks ALTER COLUMN embedding TYPE halfvec(1536) USING embedding::halfvec(1536)")
+    if legacy and _column_type("documents", "tags") != "jsonb":
+        op.execute("ALTER TABLE documents ALTER COLUMN tags TYPE jsonb USING tags::jsonb")
+
+    # Keep vectors inline and uncompressed so index scans don't detoast them
+    op.execute("ALTER TABLE chunks ALTER COLUMN embedding SET STORAGE PLAIN")
+    op.execute("ALTER TABLE chunks SET (toast_tuple_target = 8160)")
+
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS idx_chunks_embedding_hnsw ON chunks "
+        "USING hnsw (embedding halfvec_cosine_ops) WITH (m = 24, ef_construction = 128)"
+    )
+    op.execute("CREATE INDEX IF NOT EXISTS ix_documents_tags ON documents USING gin (tags)")
+
+
+def downgrade():
+    op.drop_table("tool_logs")
+    op.drop_table("tickets")
+    op.drop_table("chunks")
+    op.drop_table("documents")
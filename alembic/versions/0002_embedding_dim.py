@@ -0,0 +1,27 @@
+"""chunks.embedding NOT NULL
+
+The column stays halfvec(1536) as created by 0001: migrations don't depend on the
+configured embedding model. Switching to a model of another width is an explicit
+step, `python -m scripts.resize_embeddings`.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-15
+"""
+from alembic import op
+
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Chunks without an embedding can never be returned by the HNSW search
+    op.execute("DELETE FROM chunks WHERE embedding IS NULL")
+    op.alter_column("chunks", "embedding", nullable=False)
+
+
+def downgrade():
+    op.alter_column("chunks", "embedding", nullable=True)
@@ -0,0 +1,37 @@
+"""semantic answer cache for workflow tickets
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-15
+"""
+from alembic import op
+import sqlalchemy as sa
+from pgvector.sqlalchemy import HALFVEC
+
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "ticket_answer_cache",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("embedding", HALFVEC(1536), nullable=False),
+        sa.Column("question", sa.Text()),
+        sa.Column("category", sa.String(), nullable=True),
+        sa.Column("answer", sa.Text()),
+        sa.Column("sources", sa.JSON()),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.create_index("ix_ticket_answer_cache_id", "ticket_answer_cache", ["id"])
+    op.execute(
+        "CREATE INDEX idx_ticket_answer_cache_embedding_hnsw ON ticket_answer_cache "
+        "USING hnsw (embedding halfvec_cosine_ops) WITH (m = 16, ef_construction = 64)"
+    )
+
+
+def downgrade():
+    op.drop_table("ticket_answer_cache")
@@ -1,6 +1,7 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
+from typing import List, Optional
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.db.database import get_db
 from app.services.kb.ingestion import ingest_kb
 from app.services.kb.search import KBSearchService
@@ -17,13 +18,19 @@ class SearchResponse(BaseModel):
     results: list
 
 @router.post("/ingest")
-def ingest_endpoint(req: IngestRequest, background_tasks: BackgroundTasks):
-    # Running in background to avoid timeout
+async def ingest_endpoint(req: IngestRequest, background_tasks: BackgroundTasks):
+    # Running in background to avoid timeout (sync task, executed in the threadpool)
     background_tasks.add_task(ingest_kb, req.path, req.reindex, req.chunk_size, req.chunk_overlap)
     return {"message": "Ingestion started in background"}
 
 @router.get("/search")
-def search_endpoint(q: str, k: int = 5, db: Session = Depends(get_db)):
+async def search_endpoint(
+    q: str,
+    k: int = 5,
+    category: Optional[str] = None,
+    tags: Optional[List[str]] = Query(None),
+    db: AsyncSession = Depends(get_db)
+):
     service = KBSearchService(db)
-    results = service.search(q, k)
+    results = await service.search(q, k, category=category, tags=tags)
     return {"results": results}
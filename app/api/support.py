@@ -1,30 +1,86 @@
+import orjson
+import os
 from fastapi import APIRouter, Depends, HTTPException, Query as QueryParam
-from pydantic import BaseModel
-from sqlalchemy.orm import Session
-from typing import Optional, Dict
-from app.db.database import get_db
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import AsyncIterator, Optional, Dict, List
+import structlog
+from app.db.database import get_db, session_scope
 from app.db.models import Ticket
 from app.services.support.workflow import WorkflowEngine
 from app.services.support.agent import AgentEngine
 
+logger = structlog.get_logger()
+
 router = APIRouter(prefix="/support", tags=["Support"])
 
+# Upper bound on cases per /query/batch request (each one is a full RAG + LLM run)
+MAX_BATCH_CASES = int(os.getenv("SUPPORT_MAX_BATCH_CASES", "20"))
+
 class SupportQuery(BaseModel):
     question: str
     context: Optional[Dict] = {}
     mode: str = "workflow"  # workflow or agent
+    stream: bool = False  # answer as Server-Sent Events
 
 @router.post("/query")
-def support_query(req: SupportQuery, db: Session = Depends(get_db)):
+async def support_query(req: SupportQuery, db: AsyncSession = Depends(get_db)):
+    if req.mode not in ("workflow", "agent"):
+        raise HTTPException(status_code=400, detail="Invalid mode. use 'workflow' or 'agent'")
+
+    if req.stream:
+        return StreamingResponse(_sse_events(req), media_type="text/event-stream")
+
     if req.mode == "workflow":
         engine = WorkflowEngine(db)
-        ticket = engine.run(req.question, req.context)
-    elif req.mode == "agent":
-        engine = AgentEngine(db)
-        ticket = engine.run(req.question, req.context)
+        ticket = await engine.run(req.question, req.context)
     else:
-        raise HTTPException(status_code=400, detail="Invalid mode. use 'workflow' or 'agent'")
-    
+        engine = AgentEngine(db)
+        ticket = await engine.run(req.question, req.context)
+
     return {"ticket_id": ticket.id, "answer": ticket.answer, "sources": ticket.sources}
 
+class SupportCase(BaseModel):
+    question: str
+    context: Optional[Dict] = {}
+
+class SupportBatchQuery(BaseModel):
+    cases: List[SupportCase] = Field(..., min_length=1, max_length=MAX_BATCH_CASES)
+
+@router.post("/query/batch")
+async def support_query_batch(req: SupportBatchQuery, db: AsyncSession = Depends(get_db)):
+    """
+    Workflow mode only: all cases are answered concurrently and the answered ones saved in one
+    transaction. A failed case gets an `error` entry instead of failing the whole batch.
+    """
+    results = await WorkflowEngine(db).run_many([(case.question, case.context) for case in req.cases])
+    response = []
+    for t in results:
+        if isinstance(t, Exception):
+            response.append({"error": str(t)})
+        else:
+            response.append({"ticket_id": t.id, "answer": t.answer, "sources": t.sources, "latency_ms": t.latency_ms})
+    return response
+
+async def _sse_events(req: SupportQuery) -> AsyncIterator[str]:
+    """
+    Streams `token` events with answer text, then a `done` event with ticket_id and sources
+    (or an `error` event). Agent mode may send `reset`: drop the text received so far.
+    """
+    # Own session: the request-scoped one is not guaranteed to outlive the response body
+    async with session_scope() as db:
+        if req.mode == "agent":
+            events = AgentEngine(db).stream(req.question, req.context)
+        else:
+            events = WorkflowEngine(db).run_streaming(req.question, req.context)
 
+        try:
+            async for event in events:
+                if event["type"] == "done":
+                    ticket = event["ticket"]
+                    event = {"type": "done", "ticket_id": ticket.id, "sources": ticket.sources}
+                yield f"data: {orjson.dumps(event).decode()}\n\n"
+        except Exception as e:
+            logger.error("Streaming query failed", error=str(e), mode=req.mode)
+            yield f"data: {orjson.dumps({'type': 'error', 'detail': str(e)}).decode()}\n\n"
@@ -1,13 +1,18 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 from app.db.database import get_db
 from app.db.models import Ticket
 
 router = APIRouter(prefix="/tickets", tags=["Tickets"])
 
 @router.get("/{id}")
-def get_ticket(id: int, db: Session = Depends(get_db)):
-    ticket = db.query(Ticket).filter(Ticket.id == id).first()
+async def get_ticket(id: int, db: AsyncSession = Depends(get_db)):
+    result = await db.execute(
+        select(Ticket).options(selectinload(Ticket.tool_logs)).filter(Ticket.id == id)
+    )
+    ticket = result.scalars().first()
     if not ticket:
         raise HTTPException(status_code=404, detail="Ticket not found")
     
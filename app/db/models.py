@@ -1,8 +1,9 @@
-from sqlalchemy import Column, Integer, String, DateTime, JSON, ForeignKey, Text, Float
+from sqlalchemy import Column, Integer, String, DateTime, JSON, ForeignKey, Text, Float, Index
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
-from pgvector.sqlalchemy import Vector
-from app.db.database import Base
+from pgvector.sqlalchemy import HALFVEC
+from app.db.database import Base, EMBED_DIM, HNSW_INDEX_NAME
 
 class Document(Base):
     __tablename__ = "documents"
@@ -10,12 +11,16 @@ class Document(Base):
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, index=True)
     category = Column(String, index=True)
-    tags = Column(JSON, default=[])
+    tags = Column(JSONB, default=[])  # JSONB for containment (@>) filters
     source = Column(String)  # file path relative to project root
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     chunks = relationship("Chunk", back_populates="document", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        Index("ix_documents_tags", "tags", postgresql_using="gin"),
+    )
+
 class Chunk(Base):
     __tablename__ = "chunks"
 
@@ -23,13 +28,23 @@ class Chunk(Base):
     document_id = Column(Integer, ForeignKey("documents.id"))
     chunk_index = Column(Integer)
     chunk_text = Column(Text)
-    # Dimension will assume 1536 for OpenAI embeddings implicitly or can be dynamic
-    embedding = Column(Vector()) 
+    # Half-precision vectors: half the memory/IO of vector(n); fixed dimension is required for HNSW
+    embedding = Column(HALFVEC(EMBED_DIM), nullable=False)
     metadata_ = Column("metadata", JSON, default={}) # 'metadata' is reserved in Base
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     document = relationship("Document", back_populates="chunks")
 
+    __table_args__ = (
+        Index(
+            HNSW_INDEX_NAME,
+            "embedding",
+            postgresql_using="hnsw",
+            postgresql_with={"m": 24, "ef_construction": 128},
+            postgresql_ops={"embedding": "halfvec_cosine_ops"}
+        ),
+    )
+
 class Ticket(Base):
     __tablename__ = "tickets"
 
@@ -44,7 +59,7 @@ class Ticket(Base):
     token_usage = Column(JSON, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
-    tool_logs = relationship("ToolLog", back_populates="ticket", cascade="all, delete-orphan")
+    tool_logs = relationship("ToolLog", back_populates="ticket", cascade="all, delete-orphan", order_by="[ToolLog.step, ToolLog.id]")
 
 class ToolLog(Base):
     __tablename__ = "tool_logs"
@@ -58,3 +73,25 @@ class ToolLog(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     ticket = relationship("Ticket", back_populates="tool_logs")
+
+class TicketAnswerCache(Base):
+    """Answered workflow tickets, looked up by embedding similarity of question + context."""
+    __tablename__ = "ticket_answer_cache"
+
+    id = Column(Integer, primary_key=True, index=True)
+    embedding = Column(HALFVEC(EMBED_DIM), nullable=False)
+    question = Column(Text)
+    category = Column(String, nullable=True)
+    answer = Column(Text)
+    sources = Column(JSON, default=[])
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index(
+            "idx_ticket_answer_cache_embedding_hnsw",
+            "embedding",
+            postgresql_using="hnsw",
+            postgresql_with={"m": 16, "ef_construction": 64},
+            postgresql_ops={"embedding": "halfvec_cosine_ops"}
+        ),
+    )
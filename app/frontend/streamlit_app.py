@@ -8,6 +8,20 @@ from datetime import datetime
 # Configuration
 API_URL = os.getenv("API_URL", "http://localhost:8001")
 
+# The script re-executes on every interaction; cache_resource keeps one keep-alive session across reruns
+@st.cache_resource
+def get_session() -> requests.Session:
+    return requests.Session()
+
+SESSION = get_session()
+
+@st.cache_data(ttl=10)
+def probe() -> bool:
+    try:
+        return SESSION.get(f"{API_URL}/health", timeout=1).status_code == 200
+    except requests.RequestException:
+        return False
+
 st.set_page_config(
     page_title="Tech Support Assistant",
     page_icon="🤖",
@@ -65,13 +79,7 @@ with st.sidebar:
     st.image("https://img.icons8.com/clouds/100/000000/bot.png", width=100)
     st.markdown("### Status & Settings")
     
-    api_status = "🔴 Offline"
-    try:
-        resp = requests.get(f"{API_URL}/health", timeout=1)
-        if resp.status_code == 200:
-            api_status = "🟢 Online"
-    except:
-        pass
+    api_status = "🟢 Online" if probe() else "🔴 Offline"
     
     st.markdown(f"**Backend:** {api_status}")
     st.code(API_URL, language="text")
@@ -143,16 +151,35 @@ with tab_chat:
                     payload = {
                         "question": prompt,
                         "context": context_dict,
-                        "mode": mode
+                        "mode": mode,
+                        "stream": True
                     }
                     
                     start_time = time.time()
-                    resp = requests.post(f"{API_URL}/support/query", json=payload, timeout=60)
-                    latency = time.time() - start_time
+                    resp = SESSION.post(f"{API_URL}/support/query", json=payload, timeout=60, stream=True)
                     
                     if resp.status_code == 200:
-                        data = resp.json()
-                        answer = data.get("answer", "No answer provided.")
+                        # Server-Sent Events: render tokens as they arrive
+                        answer = ""
+                        data = {}
+                        for line in resp.iter_lines(decode_unicode=True):
+                            if not line or not line.startswith("data: "):
+                                continue
+                            event = json.loads(line[len("data: "):])
+                            if event["type"] == "token":
+                                answer += event["content"]
+                                message_placeholder.markdown(answer + "▌")
+                            elif event["type"] == "reset":
+                                # Agent text before a tool call is not part of the answer
+                                answer = ""
+                                message_placeholder.markdown("▌")
+                            elif event["type"] == "done":
+                                data = event
+                            elif event["type"] == "error":
+                                raise RuntimeError(event["detail"])
+                        latency = time.time() - start_time
+
+                        answer = answer or "No answer provided."
                         ticket_id = data.get("ticket_id")
                         
                         # Formatting response
@@ -194,7 +221,7 @@ with tab_kb:
             with st.status("Ingesting Knowledge Base...", expanded=True) as status:
                 st.write("Requesting backend...")
                 try:
-                    resp = requests.post(
+                    resp = SESSION.post(
                         f"{API_URL}/kb/ingest", 
                         json={"path": kb_path_in, "reindex": force_reindex}
                     )
@@ -217,7 +244,7 @@ with tab_kb:
         
         if q and st.button("Search KB"):
             try:
-                r = requests.get(f"{API_URL}/kb/search", params={"q": q, "k": top_k})
+                r = SESSION.get(f"{API_URL}/kb/search", params={"q": q, "k": top_k})
                 results = r.json().get("results", [])
                 
                 for idx, item in enumerate(results):
@@ -240,7 +267,7 @@ with tab_tickets:
     
     if load_btn and tid:
         try:
-            resp = requests.get(f"{API_URL}/tickets/{tid}")
+            resp = SESSION.get(f"{API_URL}/tickets/{tid}")
             if resp.status_code == 200:
                 ticket = resp.json()
                 
@@ -3,7 +3,8 @@ load_dotenv()
 
 from fastapi import FastAPI
 from app.api import kb, support, tickets
-from app.db.database import init_db
+from app.db.database import EMBEDDING_MODEL, check_db, warm_pool
+from app.services.llm import client
 import structlog
 
 logger = structlog.get_logger()
@@ -11,13 +12,20 @@ logger = structlog.get_logger()
 app = FastAPI(title="Tech Support Assistant")
 
 @app.on_event("startup")
-def startup_event():
-    init_db()
+async def startup_event():
+    # Per-worker startup stays cheap: DDL lives in Alembic migrations (alembic upgrade head)
+    await check_db()
+    # Open pooled DB connections and the OpenAI keep-alive connection before the first request
+    await warm_pool()
+    try:
+        await client.embeddings.create(input=[" "], model=EMBEDDING_MODEL)
+    except Exception as e:
+        logger.warning("OpenAI warm-up failed", error=str(e))
 
 app.include_router(kb.router)
 app.include_router(support.router)
 app.include_router(tickets.router)
 
 @app.get("/health")
-def health_check():
+async def health_check():
     return {"status": "ok"}
@@ -1,22 +1,78 @@
-import json
+import asyncio
+import io
+import orjson
 import os
 import structlog
-from typing import List, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
 import tiktoken
+from tenacity import AsyncRetrying, retry_if_exception_type, stop_after_attempt, wait_exponential
 from sqlalchemy.orm import Session
-from app.db.models import Document, Chunk
-from app.db.database import SessionLocal
+from app.db.models import Document, Chunk, TicketAnswerCache
+from app.db.database import EMBEDDING_MODEL, SessionLocal, configure_hnsw_params, create_embedding_index, drop_embedding_index
 import openai
+from app.services.llm import OPENAI_TIMEOUT, openai_limits
 
 logger = structlog.get_logger()
 
 # OpenAI client
-client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-EMBEDDING_MODEL = os.getenv("OPENAI_EMBED_MODEL", "text-embedding-3-small")
+EMBEDDING_CONCURRENCY = int(os.getenv("OPENAI_EMBED_CONCURRENCY", "10"))
+client = openai.OpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    http_client=openai.DefaultHttpxClient(http2=True, limits=openai_limits(EMBEDDING_CONCURRENCY), timeout=OPENAI_TIMEOUT)
+)
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "16"))
+# Per-request limits of the embeddings API (2048 inputs, 300k tokens); tokens with headroom
+EMBED_REQUEST_MAX_INPUTS = 2048
+EMBED_REQUEST_MAX_TOKENS = int(os.getenv("OPENAI_EMBED_REQUEST_MAX_TOKENS", "250000"))
+
+def _embedding_vectors(response) -> List[List[float]]:
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+def get_embeddings(texts: List[str]) -> List[List[float]]:
+    """Embeds a batch of texts with a single API request, preserving input order."""
+    texts = [text.replace("\n", " ") for text in texts]
+    return _embedding_vectors(client.embeddings.create(input=texts, model=EMBEDDING_MODEL))
+
+async def aget_embeddings_many(batches: List[List[str]]) -> List[Any]:
+    """
+    Embeds several batches concurrently, at most EMBEDDING_CONCURRENCY requests in flight.
+    Returns one list of vectors per batch, or the exception that batch failed with.
+    """
+    sem = asyncio.Semaphore(EMBEDDING_CONCURRENCY)
+
+    # A fresh client per call: its connection pool is bound to the running event loop
+    async with openai.AsyncOpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        http_client=openai.DefaultAsyncHttpxClient(http2=True, limits=openai_limits(EMBEDDING_CONCURRENCY), timeout=OPENAI_TIMEOUT)
+    ) as aclient:
+        async def embed(texts: List[str]) -> List[List[float]]:
+            if not texts:
+                return []
+            texts = [text.replace("\n", " ") for text in texts]
+            async with sem:
+                async for attempt in AsyncRetrying(
+                    # Throttling and transient failures; 4xx errors other than 429 won't succeed on retry
+                    retry=retry_if_exception_type((openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)),
+                    wait=wait_exponential(multiplier=1, max=30),
+                    stop=stop_after_attempt(6),
+                    reraise=True
+                ):
+                    with attempt:
+                        response = await aclient.embeddings.create(input=texts, model=EMBEDDING_MODEL)
+            return _embedding_vectors(response)
+
+        return await asyncio.gather(*(embed(batch) for batch in batches), return_exceptions=True)
 
 def get_embedding(text: str) -> List[float]:
-    text = text.replace("\n", " ")
-    return client.embeddings.create(input=[text], model=EMBEDDING_MODEL).data[0].embedding
+    return get_embeddings([text])[0]
+
+def _copy_escape(value: str) -> str:
+    # Escapes a value for COPY's text format
+    return value.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+def _vector_literal(embedding: List[float]) -> str:
+    return "[" + ",".join(map(str, embedding)) + "]"
 
 class KBIngestor:
     def __init__(self, kb_path: str, db: Session):
@@ -26,8 +82,8 @@ class KBIngestor:
 
     def load_index(self) -> List[Dict[str, Any]]:
         index_path = os.path.join(self.kb_path, "index.json")
-        with open(index_path, "r") as f:
-            return json.load(f)
+        with open(index_path, "rb") as f:
+            return orjson.loads(f.read())
 
     def split_text(self, text: str, chunk_size: int = 800, chunk_overlap: int = 100) -> List[str]:
         """
@@ -38,82 +94,151 @@ class KBIngestor:
         total_tokens = len(tokens)
         chunks = []
         
-        start = 0
-        while start < total_tokens:
+        for start in range(0, total_tokens, chunk_size - chunk_overlap):
             end = min(start + chunk_size, total_tokens)
-            chunk_tokens = tokens[start:end]
-            chunk_text = self.tokenizer.decode(chunk_tokens)
-            chunks.append(chunk_text)
+            chunks.append(self.tokenizer.decode(tokens[start:end]))
             
             if end == total_tokens:
                 break
-                
-            start += chunk_size - chunk_overlap
             
         return chunks
 
+    def request_batches(self, texts: List[str]) -> List[List[str]]:
+        """Groups a document's chunks into embedding requests within the per-request input and token limits."""
+        batches, batch, batch_tokens = [], [], 0
+        for text in texts:
+            tokens = len(self.tokenizer.encode(text))
+            if batch and (len(batch) >= EMBED_REQUEST_MAX_INPUTS or batch_tokens + tokens > EMBED_REQUEST_MAX_TOKENS):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(text)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def read_and_split(self, entry: Dict[str, Any], chunk_size: int, chunk_overlap: int) -> Optional[Tuple[Dict[str, Any], List[str]]]:
+        filename = entry["file"]
+        file_path = os.path.join(self.kb_path, filename)
+
+        if not os.path.exists(file_path):
+            logger.warning("File not found, skipping", file=filename)
+            return None
+
+        with open(file_path, "r") as f:
+            content = f.read()
+
+        return entry, self.split_text(content, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+    def _copy_chunks(self, rows: List[tuple]):
+        """
+        Loads (document_id, chunk_index, chunk_text, embedding, metadata_json) rows
+        with a single COPY instead of one INSERT per chunk.
+        """
+        if not rows:
+            return
+
+        buf = io.StringIO()
+        for document_id, chunk_index, chunk_text, embedding, metadata in rows:
+            buf.write(f"{document_id}\t{chunk_index}\t{_copy_escape(chunk_text)}\t{_vector_literal(embedding)}\t{_copy_escape(metadata)}\n")
+        buf.seek(0)
+
+        # Raw DBAPI connection of the session's transaction, so COPY commits with the Document rows
+        cursor = self.db.connection().connection.cursor()
+        try:
+            cursor.copy_expert(
+                "COPY chunks (document_id, chunk_index, chunk_text, embedding, metadata) FROM STDIN WITH (FORMAT text)",
+                buf
+            )
+        finally:
+            cursor.close()
+
     def ingest_all(self, reindex: bool = False, chunk_size: int = 800, chunk_overlap: int = 100):
         if reindex:
             logger.info("Clearing existing KB data...")
             self.db.query(Chunk).delete()
             self.db.query(Document).delete()
+            # Loading into an unindexed table and building the index once is much faster
+            drop_embedding_index(self.db.connection())
             self.db.commit()
 
-        index_data = self.load_index()
-        total_files = len(index_data)
-        logger.info("Starting ingestion", total_files=total_files)
+        try:
+            index_data = self.load_index()
+            total_files = len(index_data)
+            logger.info("Starting ingestion", total_files=total_files)
 
-        for i, entry in enumerate(index_data):
-            filename = entry["file"]
-            file_path = os.path.join(self.kb_path, filename)
-            
-            if not os.path.exists(file_path):
-                logger.warning("File not found, skipping", file=filename)
-                continue
-
-            with open(file_path, "r") as f:
-                content = f.read()
-
-            # Create Document
-            doc = Document(
-                title=entry.get("title", filename),
-                category=entry.get("category", "unknown"),
-                tags=entry.get("tags", []),
-                source=os.path.join(self.kb_path, filename) # Saving full relative path or just filename?
-            )
-            self.db.add(doc)
-            self.db.flush() # get ID
+            # Read and split every file first so all embedding batches can be sent at once.
+            # tiktoken releases the GIL, so threads overlap both disk reads and tokenization.
+            with ThreadPoolExecutor(max_workers=INGEST_WORKERS) as pool:
+                staged = [
+                    item for item in pool.map(lambda entry: self.read_and_split(entry, chunk_size, chunk_overlap), index_data)
+                    if item is not None
+                ]
 
-            # Create Chunks
-            text_chunks = self.split_text(content, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-            
-            for idx, chunk_text in enumerate(text_chunks):
-                # Generate embedding
-                try:
-                    embedding = get_embedding(chunk_text)
-                except Exception as e:
-                    logger.error("Embedding failed", error=str(e), chunk_index=idx, file=filename)
+            # Generate embeddings concurrently: one request per document, or several for long documents
+            doc_batches = [self.request_batches(text_chunks) for _, text_chunks in staged]
+            responses = iter(asyncio.run(aget_embeddings_many([batch for batches in doc_batches for batch in batches])))
+            results = []
+            for batches in doc_batches:
+                parts = [next(responses) for _ in batches]
+                error = next((part for part in parts if isinstance(part, Exception)), None)
+                results.append(error or [vector for part in parts for vector in part])
+
+            failed = []
+            for i, ((entry, text_chunks), embeddings) in enumerate(zip(staged, results)):
+                filename = entry["file"]
+                if isinstance(embeddings, Exception):
+                    # No Document row: one without chunks could never be found by search
+                    logger.error("Embedding failed, skipping document", error=str(embeddings), file=filename)
+                    failed.append(filename)
                     continue
 
-                chunk_obj = Chunk(
-                    document_id=doc.id,
-                    chunk_index=idx,
-                    chunk_text=chunk_text,
-                    embedding=embedding,
-                    metadata_={
-                        "file": filename,
-                        "category": doc.category,
-                        "tags": doc.tags
-                    }
+                # Create Document
+                doc = Document(
+                    title=entry.get("title", filename),
+                    category=entry.get("category", "unknown"),
+                    tags=entry.get("tags", []),
+                    source=os.path.join(self.kb_path, filename) # Saving full relative path or just filename?
                 )
-                self.db.add(chunk_obj)
+                self.db.add(doc)
+                self.db.flush() # get ID
+
+                # Create Chunks
+                metadata = orjson.dumps({
+                    "file": filename,
+                    "category": doc.category,
+                    "tags": doc.tags
+                }).decode()
+                self._copy_chunks([
+                    (doc.id, idx, chunk_text, embedding, metadata)
+                    for idx, (chunk_text, embedding) in enumerate(zip(text_chunks, embeddings))
+                ])
             
+                self.db.commit()
+                if (i + 1) % 10 == 0:
+                    logger.info("Processed files", count=i+1)
+
+            if failed:
+                logger.error("Documents not ingested", count=len(failed), files=failed)
+
+            # Cached answers were generated from the previous KB contents
+            self.db.query(TicketAnswerCache).delete()
             self.db.commit()
-            if (i + 1) % 10 == 0:
-                logger.info("Processed files", count=i+1)
+        finally:
+            if reindex:
+                # Also after a failed run: search must not be left without its index
+                self.db.rollback()
+                self._rebuild_index()
 
         logger.info("Ingestion complete")
 
+    def _rebuild_index(self):
+        vector_count = self.db.query(Chunk).count()
+        params = configure_hnsw_params(vector_count)
+        logger.info("Building HNSW index", vectors=vector_count, **params)
+        create_embedding_index(self.db.connection(), params["m"], params["ef_construction"])
+        self.db.commit()
+
 def ingest_kb(path: str, reindex: bool = True, chunk_size: int = 800, chunk_overlap: int = 100):
     db = SessionLocal()
     try:
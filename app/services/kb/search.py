@@ -1,39 +1,105 @@
 import os
-from typing import List, Dict, Any
-from sqlalchemy.orm import Session
-from sqlalchemy import select
-from app.db.models import Chunk, Document
-from app.services.kb.ingestion import get_embedding
+from collections import OrderedDict
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import bindparam, text
+from sqlalchemy.dialects.postgresql import JSONB
+from app.db.models import Chunk
+from app.db.database import EMBEDDING_MODEL, HNSW_ITERATIVE_SCAN
+from app.services.llm import EmbeddingBatcher
 import structlog
 
 logger = structlog.get_logger()
 
+QUERY_EMBEDDING_CACHE_SIZE = 4096
+_query_embedding_cache: "OrderedDict[str, Tuple[float, ...]]" = OrderedDict()
+# Concurrent requests (KB search, answer cache) share embedding API calls
+_embedding_batcher = EmbeddingBatcher(EMBEDDING_MODEL)
+
+def _normalize_query(query: str) -> str:
+    # Case and whitespace variants of a query share one cache entry
+    return " ".join(query.lower().split())
+
+async def get_query_embedding(query: str, use_cache: bool = True) -> List[float]:
+    """
+    Embeds a search query, reusing the vector for repeated queries (LRU).
+    Pass use_cache=False for one-off texts that would only evict real queries.
+    """
+    key = _normalize_query(query)
+    if not use_cache:
+        return await _embedding_batcher.embed(key)
+    cached = _query_embedding_cache.get(key)
+    if cached is not None:
+        _query_embedding_cache.move_to_end(key)
+        return list(cached)
+
+    embedding = tuple(await _embedding_batcher.embed(key))
+
+    _query_embedding_cache[key] = embedding
+    if len(_query_embedding_cache) > QUERY_EMBEDDING_CACHE_SIZE:
+        _query_embedding_cache.popitem(last=False)
+    return list(embedding)
+
+# Keep the bare distance in ORDER BY so the HNSW index is used
+_SEARCH_SQL = """
+SELECT c.id, c.chunk_text, d.title, d.source, d.category, 1 - (c.embedding <=> :q) AS score
+FROM chunks c JOIN documents d ON d.id = c.document_id
+{where}
+ORDER BY c.embedding <=> :q
+LIMIT :k
+"""
+
+@lru_cache(maxsize=None)
+def _search_statement(by_category: bool, by_tags: bool):
+    """One statement per filter combination, so each SQL string stays prepared on the connection."""
+    conditions = []
+    params = [bindparam("q", type_=Chunk.embedding.type)]
+    if by_category:
+        conditions.append("d.category = :category")
+    if by_tags:
+        conditions.append("d.tags @> :tags")
+        params.append(bindparam("tags", type_=JSONB))
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return text(_SEARCH_SQL.format(where=where)).bindparams(*params)
+
 class KBSearchService:
-    def __init__(self, db: Session):
+    def __init__(self, db: AsyncSession):
         self.db = db
 
-    def search(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
+    async def search(
+        self,
+        query: str,
+        k: int = 5,
+        category: Optional[str] = None,
+        tags: Optional[List[str]] = None
+    ) -> List[Dict[str, Any]]:
         # Embed query
-        query_embedding = get_embedding(query)
+        query_embedding = await get_query_embedding(query)
 
-        # Search using cosine distance operator <=>
-        stmt = select(Chunk, Document).join(Document).order_by(
-            Chunk.embedding.cosine_distance(query_embedding)
-        ).limit(k)
+        # Metadata pre-filters shrink the candidate set (B-tree on category, GIN on tags)
+        filtered = bool(category or tags)
+        if filtered and HNSW_ITERATIVE_SCAN:
+            await self.db.execute(text(f"SET LOCAL hnsw.iterative_scan = {HNSW_ITERATIVE_SCAN}"))
 
-        results = self.db.execute(stmt).all()
+        stmt = _search_statement(bool(category), bool(tags))
+        results = (await self.db.execute(stmt, {"q": query_embedding, "k": k, "category": category, "tags": tags})).all()
         
         output = []
-        for chunk, doc in results:
+        for row in results:
             output.append({
-                "chunk_id": chunk.id,
-                "text": chunk.chunk_text,
+                "chunk_id": row.id,
+                "text": row.chunk_text,
                 "document": {
-                    "title": doc.title,
-                    "source": doc.source,
-                    "category": doc.category
+                    "title": row.title,
+                    "source": row.source,
+                    "category": row.category
                 },
-                "score": 0.0 # TODO: Calculate score if needed, or return distance
+                "score": float(row.score)
             })
+
+        if filtered:
+            # relaxed_order may return rows slightly out of distance order
+            output.sort(key=lambda r: r["score"], reverse=True)
         
         return output
@@ -0,0 +1,83 @@
+import asyncio
+import os
+from typing import List, Optional, Set, Tuple
+import httpx
+import openai
+
+# HTTP/2 keep-alive pool; the default allows far fewer connections than OPENAI_MAX_CONCURRENCY
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "64"))
+OPENAI_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+
+def openai_limits(max_connections: int = OPENAI_MAX_CONNECTIONS) -> httpx.Limits:
+    return httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+
+# One async client per process so every request shares its connection pool
+client = openai.AsyncOpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    http_client=openai.DefaultAsyncHttpxClient(http2=True, limits=openai_limits(), timeout=OPENAI_TIMEOUT)
+)
+
+# Caps OpenAI requests being issued per process. Streamed responses are consumed after release,
+# so a slow SSE client can't hold a slot for the length of its answer
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "32"))
+openai_limiter = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
+
+# Embedding micro-batching: requests arriving within the window share one API call
+EMBED_BATCH_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", "30"))
+EMBED_BATCH_MAX_SIZE = int(os.getenv("EMBED_BATCH_MAX_SIZE", "32"))
+
+class EmbeddingBatcher:
+    """Coalesces concurrent single-text embedding requests into list-input API calls."""
+
+    def __init__(self, model: str, window_ms: float = EMBED_BATCH_WINDOW_MS, max_size: int = EMBED_BATCH_MAX_SIZE):
+        self.model = model
+        self.window = window_ms / 1000
+        self.max_size = max_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._flushes: Set[asyncio.Task] = set()
+
+    async def embed(self, text: str) -> List[float]:
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._collect())
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((text, future))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Flush in the background so the next window starts collecting immediately
+            task = asyncio.create_task(self._flush(batch))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, batch: List[Tuple[str, asyncio.Future]]):
+        try:
+            async with openai_limiter:
+                response = await client.embeddings.create(input=[text for text, _ in batch], model=self.model)
+        except Exception as e:
+            if len(batch) > 1:
+                # The API rejects the whole request for one bad input (e.g. over the token limit):
+                # retry one by one so only the offending caller gets the error
+                await asyncio.gather(*(self._flush([entry]) for entry in batch))
+                return
+            _, future = batch[0]
+            if not future.done():
+                future.set_exception(e)
+            return
+        for item in response.data:
+            future = batch[item.index][1]
+            if not future.done():
+                future.set_result(item.embedding)
@@ -1,73 +1,91 @@
-import json
-import os
+import asyncio
+import orjson
 import structlog
-from sqlalchemy.orm import Session
+from typing import AsyncIterator, List, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db.database import AsyncSessionLocal
 from app.db.models import Ticket, ToolLog
 from app.services.kb.search import KBSearchService
-import openai
+from app.services.llm import client, openai_limiter
 
 logger = structlog.get_logger()
-client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 MODEL = "gpt-4o-mini"
 
+# Prompt and tool definitions are constant and built once. Later turns of a run resend the whole
+# conversation, so once it passes 1024 tokens OpenAI prompt caching covers the earlier turns
+_AGENT_SYSTEM = """You are an advanced Tech Support Agent.
+Your goal is to diagnose and solve the user's issue using the available tools.
+1. Analyze the issue.
+2. Search the knowledge base.
+3. if needed, refined search or ask for clarification (simulated).
+4. Provide a final answer in the required format.
+"""
+
+_AGENT_USER_TMPL = "Question: {question}\nContext: {context}"
+
+_AGENT_TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "kb_search",
+            "description": "Search the knowledge base for relevant articles.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query": {"type": "string", "description": "The search query."}
+                },
+                "required": ["query"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "classify_issue",
+            "description": "Classify the issue category.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "category": {"type": "string", "description": "Category name (e.g. docker, nginx)"},
+                    "severity": {"type": "string", "enum": ["low", "medium", "high"]}
+                },
+                "required": ["category"]
+            }
+        }
+    }
+]
+
 class AgentEngine:
-    def __init__(self, db: Session):
+    def __init__(self, db: AsyncSession):
         self.db = db
-        self.search_service = KBSearchService(db)
 
-    def run(self, question: str, context: dict) -> Ticket:
-        # Create Ticket first to log steps
+    async def run(self, question: str, context: dict) -> Ticket:
+        ticket = None
+        async for event in self.stream(question, context):
+            if event["type"] == "done":
+                ticket = event["ticket"]
+        return ticket
+
+    async def stream(self, question: str, context: dict) -> AsyncIterator[dict]:
+        """
+        Runs the agent, yielding {"type": "token", "content": ...} events as the answer is
+        generated and a final {"type": "done", "ticket": ...} once the ticket is committed.
+        A {"type": "reset"} event means the text streamed so far was not the answer (the model
+        went on to call tools) and must be discarded; the stored answer is what remains.
+        """
+        # Nothing touches the session until the run is over: no pooled connection is held
+        # across LLM turns, and a failed run leaves nothing to roll back
         ticket = Ticket(
             mode="agent",
             question=question,
             context=context,
-            category="pending"
+            category="pending",
+            tool_logs=[]
         )
-        self.db.add(ticket)
-        self.db.commit()
-        self.db.refresh(ticket)
 
         messages = [
-            {"role": "system", "content": """You are an advanced Tech Support Agent. 
-            Your goal is to diagnose and solve the user's issue using the available tools.
-            1. Analyze the issue.
-            2. Search the knowledge base.
-            3. if needed, refined search or ask for clarification (simulated).
-            4. Provide a final answer in the required format.
-            """},
-            {"role": "user", "content": f"Question: {question}\nContext: {json.dumps(context)}"}
-        ]
-
-        tools = [
-            {
-                "type": "function",
-                "function": {
-                    "name": "kb_search",
-                    "description": "Search the knowledge base for relevant articles.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "query": {"type": "string", "description": "The search query."}
-                        },
-                        "required": ["query"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "classify_issue",
-                    "description": "Classify the issue category.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "category": {"type": "string", "description": "Category name (e.g. docker, nginx)"},
-                            "severity": {"type": "string", "enum": ["low", "medium", "high"]}
-                        },
-                        "required": ["category"]
-                    }
-                }
-            }
+            {"role": "system", "content": _AGENT_SYSTEM},
+            {"role": "user", "content": _AGENT_USER_TMPL.format(question=question, context=orjson.dumps(context).decode())}
         ]
 
         steps = 0
@@ -77,73 +95,115 @@ class AgentEngine:
 
         while steps < max_steps:
             steps += 1
-            response = client.chat.completions.create(
-                model=MODEL,
-                messages=messages,
-                tools=tools,
-                tool_choice="auto"
-            )
-            msg = response.choices[0].message
+
+            # Stream every turn: answer tokens go out as they arrive, tool calls are assembled from deltas.
+            # Only the last turn is the answer: text of a turn that turns out to call tools is retracted
+            content_parts = []
+            tool_calls = {}
+            streamed = False
+            async with openai_limiter:
+                response = await client.chat.completions.create(
+                    model=MODEL,
+                    messages=messages,
+                    tools=_AGENT_TOOLS,
+                    tool_choice="auto",
+                    stream=True
+                )
+            # Consumed outside the limiter: yields wait on the caller (e.g. an SSE client)
+            async with response:
+                async for chunk in response:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta
+                    if delta.content:
+                        content_parts.append(delta.content)
+                        if not tool_calls:
+                            streamed = True
+                            yield {"type": "token", "content": delta.content}
+                    if delta.tool_calls and streamed:
+                        streamed = False
+                        yield {"type": "reset"}
+                    for tc in delta.tool_calls or []:
+                        call = tool_calls.setdefault(tc.index, {"id": "", "name": "", "arguments": ""})
+                        if tc.id:
+                            call["id"] = tc.id
+                        if tc.function and tc.function.name:
+                            call["name"] += tc.function.name
+                        if tc.function and tc.function.arguments:
+                            call["arguments"] += tc.function.arguments
+
+            content = "".join(content_parts)
+            calls = [tool_calls[i] for i in sorted(tool_calls)]
+            msg = {"role": "assistant", "content": content or None}
+            if calls:
+                msg["tool_calls"] = [{
+                    "id": call["id"],
+                    "type": "function",
+                    "function": {"name": call["name"], "arguments": call["arguments"]}
+                } for call in calls]
             messages.append(msg)
 
-            if msg.tool_calls:
-                for tool_call in msg.tool_calls:
-                    func_name = tool_call.function.name
-                    args = json.loads(tool_call.function.arguments)
-                    
-                    # Log tool usage
-                    self._log_tool_step(ticket.id, steps, func_name, args)
-
-                    tool_result = ""
-                    if func_name == "kb_search":
-                        results = self.search_service.search(args["query"])
-                        tool_result = json.dumps([{
-                            "text": r["text"][:200] + "...", 
-                            "title": r["document"]["title"]
-                        } for r in results])
-                        # Collect sources
-                        for r in results:
-                            sources.append({"title": r["document"]["title"], "source": r["document"]["source"]})
-                            
-                    elif func_name == "classify_issue":
-                        ticket.category = args["category"]
-                        self.db.commit()
-                        tool_result = f"Classified as {args['category']}"
+            if calls:
+                calls = [(call, orjson.loads(call["arguments"] or "{}")) for call in calls]
+
+                # Run all tool calls of this turn concurrently; gather keeps tool_call order
+                outputs = await asyncio.gather(*(
+                    self._dispatch(ticket, call["name"], args) for call, args in calls
+                ))
+
+                logs = []
+                for (call, args), (tool_result, tool_sources) in zip(calls, outputs):
+                    sources.extend(tool_sources)
 
                     # Append tool result
                     messages.append({
                         "role": "tool",
-                        "tool_call_id": tool_call.id,
+                        "tool_call_id": call["id"],
                         "content": tool_result
                     })
-                    
-                    # Update tool log with output
-                    self._update_tool_log_output(ticket.id, steps, tool_result)
+
+                    # Log tool usage, input and output together
+                    logs.append(ToolLog(
+                        step=steps,
+                        tool_name=call["name"],
+                        tool_input=args,
+                        tool_output=tool_result
+                    ))
+
+                # Inserted with the ticket, which assigns their ticket_id
+                ticket.tool_logs.extend(logs)
             else:
                 # No tool calls, presumably final answer
-                final_answer = msg.content
+                final_answer = content
                 break
         
         ticket.answer = final_answer
-        # De-duplicate sources
-        ticket.sources = [dict(t) for t in {tuple(d.items()) for d in sources}]
-        self.db.commit()
-        return ticket
+        # De-duplicate sources by (title, source), keeping first-seen order for citations
+        unique_sources = {}
+        for entry in sources:
+            unique_sources.setdefault((entry["title"], entry["source"]), entry)
+        ticket.sources = list(unique_sources.values())
 
-    def _log_tool_step(self, ticket_id, step, tool_name, tool_input):
-        log = ToolLog(
-            ticket_id=ticket_id,
-            step=step,
-            tool_name=tool_name,
-            tool_input=tool_input
-        )
-        self.db.add(log)
-        self.db.commit()
-
-    def _update_tool_log_output(self, ticket_id, step, output):
-        # In a real scenario we'd query by ID, but simplified here by assuming order or looking up last
-        # Actually safer to just filter by ticket_id & step
-        log = self.db.query(ToolLog).filter_by(ticket_id=ticket_id, step=step).first()
-        if log:
-            log.tool_output = output
-            self.db.commit()
+        self.db.add(ticket)
+        await self.db.commit()
+
+        yield {"type": "done", "ticket": ticket}
+
+    async def _dispatch(self, ticket: Ticket, func_name: str, args: dict) -> Tuple[str, List[dict]]:
+        """Executes one tool call, returning the tool message content and any KB sources."""
+        if func_name == "kb_search":
+            # Separate session: one AsyncSession cannot run concurrent queries
+            async with AsyncSessionLocal() as db:
+                results = await KBSearchService(db).search(args["query"])
+            tool_result = orjson.dumps([{
+                "text": r["text"][:200] + "...", 
+                "title": r["document"]["title"]
+            } for r in results]).decode()
+            # Collect sources
+            return tool_result, [{"title": r["document"]["title"], "source": r["document"]["source"]} for r in results]
+
+        if func_name == "classify_issue":
+            ticket.category = args["category"]
+            return f"Classified as {args['category']}", []
+
+        return "", []
@@ -0,0 +1,53 @@
+import orjson
+import os
+from typing import Optional
+from sqlalchemy import bindparam, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db.models import TicketAnswerCache
+from app.services.kb.search import get_query_embedding
+import structlog
+
+logger = structlog.get_logger()
+
+# Cosine distance below which a stored answer is reused for a new ticket
+ANSWER_CACHE_MAX_DISTANCE = float(os.getenv("ANSWER_CACHE_MAX_DISTANCE", "0.08"))
+# Keeps the key text under the embedding model's 8191-token input limit
+ANSWER_CACHE_MAX_KEY_CHARS = int(os.getenv("ANSWER_CACHE_MAX_KEY_CHARS", "8000"))
+
+_LOOKUP_SQL = text("""
+SELECT id, category, answer, sources, embedding <=> :q AS distance
+FROM ticket_answer_cache
+ORDER BY embedding <=> :q
+LIMIT 1
+""").bindparams(bindparam("q", type_=TicketAnswerCache.embedding.type))
+
+def serialize_context(context: dict) -> str:
+    # Sorted keys: the same context always yields the same cache text and prompt bytes
+    return orjson.dumps(context or {}, option=orjson.OPT_SORT_KEYS).decode()
+
+class AnswerCache:
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def embed(self, question: str, context_json: str) -> list:
+        """`context_json` is the ticket context as produced by serialize_context()."""
+        # Ticket texts rarely repeat verbatim: skip the query LRU so they don't evict search queries
+        key = f"{question}\n{context_json}"[:ANSWER_CACHE_MAX_KEY_CHARS]
+        return await get_query_embedding(key, use_cache=False)
+
+    async def lookup(self, embedding: list) -> Optional[dict]:
+        row = (await self.db.execute(_LOOKUP_SQL, {"q": embedding})).first()
+        if row is None or row.distance >= ANSWER_CACHE_MAX_DISTANCE:
+            return None
+        logger.info("Answer cache hit", cache_id=row.id, distance=float(row.distance))
+        return {"category": row.category, "answer": row.answer, "sources": row.sources}
+
+    def store(self, embedding: list, question: str, category: str, answer: str, sources: list):
+        """Adds the entry to the session; it is committed together with the ticket."""
+        self.db.add(TicketAnswerCache(
+            embedding=embedding,
+            question=question,
+            category=category,
+            answer=answer,
+            sources=sources
+        ))
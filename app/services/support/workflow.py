@@ -1,93 +1,244 @@
-import json
-import os
+import asyncio
+import orjson
+import time
 import structlog
-from sqlalchemy.orm import Session
+from typing import AsyncIterator, List, Optional, Tuple, Union
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db.database import AsyncSessionLocal
 from app.db.models import Ticket
 from app.services.kb.search import KBSearchService
-import openai
+from app.services.support.cache import AnswerCache, serialize_context
+from app.services.llm import client, openai_limiter
 
 logger = structlog.get_logger()
-client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 MODEL = "gpt-4o-mini" # or gpt-4-turbo
+# Analysis fields (~200 tokens) + a typical markdown answer (~900 tokens)
+MAX_OUTPUT_TOKENS = 1200
+
+# Static instructions, built once. At ~300 tokens this is below OpenAI's 1024-token prompt-caching
+# minimum, so it is not cached across tickets; the ordering only keeps the prefix stable
+_ANALYZER_SYSTEM = """You are a Technical Support Engineer answering helpdesk tickets.
+Each ticket gives you relevant knowledge base articles, optional user context
+(logs, OS, versions, etc.) and the user's query.
+
+Instructions:
+1. Classify the issue and extract important terms/error codes.
+2. Diagnose the problem based on the knowledge base.
+3. Provide a step-by-step solution.
+4. Explain how to verify the fix.
+5. List what to provide if the issue persists.
+6. Cite sources if used.
+
+Output format (the answer is streamed to the user as it is generated):
+- First line: a single-line JSON object with exactly these fields:
+  - category: one of docker, nginx, fastapi, postgres, alembic, python, git_ci, network, linux, wsl_windows, general
+  - keywords: list of important terms/error codes
+  - severity: one of low, medium, high
+- Then the full answer, formatted clearly in Markdown. Do not wrap it in JSON or a code fence.
+
+Example:
+{"category": "nginx", "keywords": ["502", "upstream", "connect() failed"], "severity": "high"}
+## Diagnosis
+...
+## Solution
+1. ...
+## Verification
+...
+## If the issue persists
+...
+## Sources
+...
+"""
+
+# Per-ticket parts go in the user message
+_ANALYZER_USER_TMPL = (
+    "Relevant Knowledge Base Articles:\n{kb_context}\n\n"
+    "User Context: {context}\n\n"
+    "User Query: {question}"
+)
+
+def _parse_header(line: str) -> dict:
+    try:
+        header = orjson.loads(line)
+    except orjson.JSONDecodeError:
+        logger.warning("Workflow answer without JSON header line")
+        return {}
+    return header if isinstance(header, dict) else {}
 
 class WorkflowEngine:
-    def __init__(self, db: Session):
+    def __init__(self, db: AsyncSession):
         self.db = db
-        self.search_service = KBSearchService(db)
-
-    def run(self, question: str, context: dict) -> Ticket:
-        # 1. Extract Signals & Classify (combined for speed or separate?)
-        # Let's do separate logical steps but maybe one LLM call if optimizing. 
-        # Requirement says "chain", implies steps.
-        
-        # Step 1: Analyze Input
-        analysis = self._analyze_input(question, context)
-        category = analysis.get("category", "general")
-        keywords = analysis.get("keywords", [])
-        
-        # Step 2: Retrieve
-        search_query = f"{question} {' '.join(keywords)}"
-        kb_results = self.search_service.search(search_query, k=5)
-        
-        # Step 3: Generate Answer
-        answer = self._generate_response(question, context, kb_results, analysis)
-        
-        # Step 4: Save Ticket
-        ticket = Ticket(
+        self.answer_cache = AnswerCache(db)
+
+    async def run(self, question: str, context: dict) -> Ticket:
+        ticket = await self._ticket(question, context)
+
+        # Save Ticket
+        self.db.add(ticket)
+        await self.db.commit()
+        await self.db.refresh(ticket)
+        return ticket
+
+    async def run_many(self, cases: List[Tuple[str, dict]]) -> List[Union[Ticket, Exception]]:
+        """
+        Answers (question, context) cases concurrently and saves the answered tickets in one commit.
+        Returns one Ticket per case, or the exception that case failed with.
+        """
+        results = await asyncio.gather(
+            *(self._ticket(question, context) for question, context in cases),
+            return_exceptions=True
+        )
+        for (question, _), result in zip(cases, results):
+            if isinstance(result, Exception):
+                logger.error("Workflow case failed", error=str(result), question=question)
+
+        # One batched INSERT ... RETURNING; ids are populated without a refresh per ticket
+        self.db.add_all([t for t in results if isinstance(t, Ticket)])
+        await self.db.commit()
+        return list(results)
+
+    async def run_streaming(self, question: str, context: dict) -> AsyncIterator[dict]:
+        """
+        Yields {"type": "token", "content": ...} events while the answer is generated,
+        then persists the ticket and yields {"type": "done", "ticket": ticket}.
+        """
+        start = time.perf_counter()
+        async for event in self._answer_events(question, context):
+            if event["type"] == "token":
+                yield event
+            else:
+                ticket = self._build_ticket(question, context, event, start)
+
+        self.db.add(ticket)
+        await self.db.commit()
+        await self.db.refresh(ticket)
+        yield {"type": "done", "ticket": ticket}
+
+    async def _ticket(self, question: str, context: dict) -> Ticket:
+        start = time.perf_counter()
+        async for event in self._answer_events(question, context):
+            if event["type"] == "result":
+                return self._build_ticket(question, context, event, start)
+
+    def _build_ticket(self, question: str, context: dict, result: dict, start: float) -> Ticket:
+        return Ticket(
             mode="workflow",
             question=question,
             context=context,
-            category=category,
-            answer=answer,
-            sources=[{"title": r["document"]["title"], "source": r["document"]["source"]} for r in kb_results]
+            category=result["category"],
+            answer=result["answer"],
+            sources=result["sources"],
+            latency_ms=(time.perf_counter() - start) * 1000
         )
-        self.db.add(ticket)
-        self.db.commit()
-        self.db.refresh(ticket)
-        return ticket
 
-    def _analyze_input(self, question: str, context: dict) -> dict:
-        prompt = f"""
-        Analyze the following technical support query.
-        Input: {question}
-        Context: {json.dumps(context)}
-        
-        Return a JSON with:
-        - category: (docker, nginx, postgres, python, etc.)
-        - keywords: list of important terms/error codes
-        - severity: (low, medium, high)
-        """
-        response = client.chat.completions.create(
-            model=MODEL,
-            messages=[{"role": "user", "content": prompt}],
-            response_format={"type": "json_object"}
+    async def _answer_events(self, question: str, context: dict) -> AsyncIterator[dict]:
+        """Yields answer `token` events, then one `result` event with category, answer and sources."""
+        # Serialized once: used for both the cache key and the prompt
+        context_json = serialize_context(context)
+
+        # Step 1: Answer-cache lookup and KB retrieval (raw question) run concurrently
+        (cache_embedding, cached), kb_results = await asyncio.gather(
+            self._cache_lookup(question, context_json),
+            self._search(question)
         )
-        return json.loads(response.choices[0].message.content)
-
-    def _generate_response(self, question: str, context: dict, kb_results: list, analysis: dict) -> str:
-        context_str = "\n".join([f"- {r['text']} (Source: {r['document']['title']})" for r in kb_results])
-        
-        prompt = f"""
-        You are a Technical Support Engineer.
-        User Query: {question}
-        User Context: {json.dumps(context)}
-        Detected Issue Category: {analysis.get('category')}
-        
-        Relevant Knowledge Base Articles:
-        {context_str}
-        
-        Instructions:
-        1. Diagnose the problem based on the knowledge base.
-        2. Provide a step-by-step solution.
-        3. Explain how to verify the fix.
-        4. List what to provide if the issue persists.
-        5. Cite sources if used.
-        
-        Format the output clearly in Markdown.
+        if cached is not None:
+            yield {"type": "token", "content": cached["answer"]}
+            yield {"type": "result", **cached}
+            return
+
+        # One pass over the results builds both the ticket sources and the prompt snippets
+        sources, snippets = [], []
+        for r in kb_results:
+            doc = r["document"]
+            sources.append({"title": doc["title"], "source": doc["source"]})
+            snippets.append(f"- {r['text']} (Source: {doc['title']})")
+
+        # Step 2: Classify and answer in a single streamed LLM call.
+        # The first line is the JSON header; everything after it is the answer and goes out as it arrives
+        header_buf = ""
+        header = None
+        answer_parts = []
+        finish_reason = None
+        async for delta, reason in self._analyze_and_answer(question, context_json, "\n".join(snippets)):
+            finish_reason = reason or finish_reason
+            if not delta:
+                continue
+            if header is None:
+                header_buf += delta
+                if "\n" not in header_buf:
+                    continue
+                line, delta = header_buf.split("\n", 1)
+                header = _parse_header(line)
+                if not header:
+                    # No header: treat everything as answer text
+                    delta = header_buf
+            if not answer_parts:
+                delta = delta.lstrip("\n")
+            if delta:
+                answer_parts.append(delta)
+                yield {"type": "token", "content": delta}
+
+        if header is None:
+            # Stream ended before a newline: either a bare header or a one-line answer
+            header = _parse_header(header_buf)
+            if not header and header_buf:
+                answer_parts.append(header_buf)
+                yield {"type": "token", "content": header_buf}
+
+        category = header.get("category") or "general"
+        answer = "".join(answer_parts)
+        # Truncated or empty answers must not be served to later tickets
+        if cache_embedding is not None and answer.strip() and finish_reason == "stop":
+            self.answer_cache.store(cache_embedding, question, category, answer, sources)
+        yield {"type": "result", "category": category, "answer": answer, "sources": sources}
+
+    # Concurrent reads use their own sessions: one AsyncSession can't run queries in parallel
+    async def _cache_lookup(self, question: str, context_json: str) -> Tuple[Optional[list], Optional[dict]]:
+        """Returns (embedding, cached answer); any failure is a cache miss, not a failed ticket."""
+        try:
+            async with AsyncSessionLocal() as db:
+                cache = AnswerCache(db)
+                embedding = await cache.embed(question, context_json)
+                return embedding, await cache.lookup(embedding)
+        except Exception as e:
+            logger.warning("Answer cache lookup failed", error=str(e))
+            return None, None
+
+    async def _search(self, question: str) -> list:
+        async with AsyncSessionLocal() as db:
+            return await KBSearchService(db).search(question, k=5)
+
+    async def _analyze_and_answer(self, question: str, context_json: str, context_str: str) -> AsyncIterator[Tuple[str, Optional[str]]]:
         """
-        
-        response = client.chat.completions.create(
-            model=MODEL,
-            messages=[{"role": "user", "content": prompt}]
+        Streams the raw completion text (JSON header line, then the markdown answer)
+        as (delta, finish_reason) pairs; finish_reason is set on the last one.
+        """
+        user_prompt = _ANALYZER_USER_TMPL.format(
+            kb_context=context_str,
+            context=context_json,
+            question=question
         )
-        return response.choices[0].message.content
+
+        async with openai_limiter:
+            response = await client.chat.completions.create(
+                model=MODEL,
+                messages=[
+                    {"role": "system", "content": _ANALYZER_SYSTEM},
+                    {"role": "user", "content": user_prompt}
+                ],
+                max_tokens=MAX_OUTPUT_TOKENS,
+                # Deterministic output: identical tickets get identical (cacheable) answers
+                temperature=0,
+                top_p=1,
+                stream=True
+            )
+        # Consumed outside the limiter: yields wait on the caller (e.g. an SSE client)
+        async with response:
+            async for chunk in response:
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                if choice.delta.content or choice.finish_reason:
+                    yield choice.delta.content or "", choice.finish_reason
+                if choice.finish_reason == "length":
+                    logger.warning("Workflow answer hit max_tokens", max_tokens=MAX_OUTPUT_TOKENS)
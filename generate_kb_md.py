@@ -8,22 +8,30 @@ Default output folder:
   data/kb_docs/
 
 Usage:
-  pip install openai pydantic python-dotenv
+  pip install openai pydantic python-dotenv tenacity orjson aiofiles "httpx[http2]"
   export OPENAI_API_KEY="..."
-  python generate_kb_md.py --total 100 --outdir data/kb_docs --model gpt-4o-mini
+  python generate_kb_md.py --total 100 --outdir data/kb_docs --model gpt-4o-mini --concurrency 8
+
+  # Offline run via the Batch API (half the token price, results within 24h)
+  python generate_kb_md.py --total 100 --batch
 """
 
 from __future__ import annotations
 
 import os
 import re
-import json
+import orjson
 import time
+import io
+import asyncio
 import argparse
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 
+import aiofiles
 from pydantic import BaseModel, Field
-from openai import OpenAI
+import httpx
+from openai import AsyncOpenAI, APITimeoutError, DefaultAsyncHttpxClient, RateLimitError
+from tenacity import AsyncRetrying, retry_if_exception_type, stop_after_attempt, wait_exponential
 
 
 # -------- Structured schema --------
@@ -142,51 +150,76 @@ DEFAULT_TOPICS: Dict[str, List[str]] = {
 }
 
 
+# Dashes are outside the class, so each run (dashes included) collapses to a single "-" in one pass
+_SLUG_NONWORD = re.compile(r"[^a-z0-9а-яё]+", re.IGNORECASE)
+
+
 def slugify(text: str, max_len: int = 70) -> str:
-    text = text.lower()
-    text = re.sub(r"[^a-z0-9а-яё]+", "-", text, flags=re.IGNORECASE)
-    text = re.sub(r"-{2,}", "-", text).strip("-")
+    text = _SLUG_NONWORD.sub("-", text.lower()).strip("-")
     if len(text) > max_len:
         text = text[:max_len].rstrip("-")
     return text or "article"
 
 
-def build_prompt(category: str, topic: str) -> List[dict]:
-    system = (
-        "Ты инженер технической поддержки. Сгенерируй статью базы знаний (KB) в формате Markdown.\n"
-        "Язык: русский.\n\n"
-        "Структура Markdown строго такая:\n"
-        "# <Title>\n"
-        "## Симптомы\n"
-        "- ...\n"
-        "## Возможные причины\n"
-        "- ...\n"
-        "## Решение (пошагово)\n"
-        "1. **Шаг** — описание\n"
-        "   ```bash\n"
-        "   <команды>\n"
-        "   ```\n"
-        "## Проверка\n"
-        "- ...\n"
-        "## Если не помогло — пришлите\n"
-        "- ...\n\n"
-        "Правила:\n"
-        "- 3–7 шагов решения.\n"
-        "- Команды должны быть безопасными (не удалять данные, не использовать rm -rf).\n"
-        "- Учитывай, что пользователь может быть на Windows/WSL/macOS/Linux — если важно, добавь развилки.\n"
-        "- Добавляй конкретику (имена сервисов, типовые пути, команды диагностики).\n"
-        "- Верни structured output по схеме.\n"
-    )
-    user = f"Категория: {category}\nСитуация: {topic}\nСгенерируй KB-статью."
-    return [{"role": "system", "content": system}, {"role": "user", "content": user}]
+# Static, built once; per-article values go in the user message
+KB_SYSTEM_PROMPT = (
+    "Ты инженер технической поддержки. Сгенерируй статью базы знаний (KB) в формате Markdown.\n"
+    "Язык: русский.\n\n"
+    "Структура Markdown строго такая:\n"
+    "# <Title>\n"
+    "## Симптомы\n"
+    "- ...\n"
+    "## Возможные причины\n"
+    "- ...\n"
+    "## Решение (пошагово)\n"
+    "1. **Шаг** — описание\n"
+    "   ```bash\n"
+    "   <команды>\n"
+    "   ```\n"
+    "## Проверка\n"
+    "- ...\n"
+    "## Если не помогло — пришлите\n"
+    "- ...\n\n"
+    "Правила:\n"
+    "- 3–7 шагов решения.\n"
+    "- Команды должны быть безопасными (не удалять данные, не использовать rm -rf).\n"
+    "- Учитывай, что пользователь может быть на Windows/WSL/macOS/Linux — если важно, добавь развилки.\n"
+    "- Добавляй конкретику (имена сервисов, типовые пути, команды диагностики).\n"
+    "- Верни structured output по схеме.\n"
+)
+
+
+KB_USER_TMPL = "Категория: {category}\nСитуация: {topic}\nСгенерируй KB-статью."
 
 
-def generate_one(client: OpenAI, model: str, category: str, topic: str) -> KBArticle:
-    resp = client.responses.parse(
-        model=model,
-        input=build_prompt(category, topic),
-        text_format=KBArticle,
-    )
+def build_prompt(category: str, topic: str) -> List[dict]:
+    user = KB_USER_TMPL.format(category=category, topic=topic)
+    return [{"role": "system", "content": KB_SYSTEM_PROMPT}, {"role": "user", "content": user}]
+
+
+def make_client(concurrency: int) -> AsyncOpenAI:
+    # One client per run: HTTP/2 keep-alive pool sized to the number of in-flight calls
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    return AsyncOpenAI(http_client=DefaultAsyncHttpxClient(
+        http2=True,
+        limits=limits,
+        timeout=httpx.Timeout(60.0, connect=5.0),
+    ))
+
+
+async def generate_one(client: AsyncOpenAI, model: str, category: str, topic: str) -> KBArticle:
+    async for attempt in AsyncRetrying(
+        retry=retry_if_exception_type((RateLimitError, APITimeoutError)),
+        wait=wait_exponential(multiplier=1, min=2, max=60),
+        stop=stop_after_attempt(6),
+        reraise=True,
+    ):
+        with attempt:
+            resp = await client.responses.parse(
+                model=model,
+                input=build_prompt(category, topic),
+                text_format=KBArticle,
+            )
     return resp.output_parsed
 
 
@@ -203,13 +236,184 @@ def ensure_outdir(outdir: str) -> None:
     os.makedirs(outdir, exist_ok=True)
 
 
+def build_jobs(categories: List[str], plan: Dict[str, int]) -> List[Tuple[int, str, str]]:
+    jobs = []
+    for cat in categories:
+        topics = DEFAULT_TOPICS.get(cat, [f"Типовая проблема для {cat}"])
+        for i in range(plan[cat]):
+            jobs.append((len(jobs) + 1, cat, topics[i % len(topics)]))
+    return jobs
+
+
+class IndexJournal:
+    """
+    Append-only index.jsonl written as articles finish, so a crashed run keeps its progress.
+    index.json is built from it once the run completes.
+    """
+
+    def __init__(self, outdir: str):
+        self.path = os.path.join(outdir, "index.jsonl")
+        self.lock = asyncio.Lock()
+        open(self.path, "wb").close()
+
+    async def append(self, entry: dict) -> None:
+        async with self.lock:
+            async with aiofiles.open(self.path, "ab") as f:
+                await f.write(orjson.dumps(entry) + b"\n")
+
+    def read(self) -> List[dict]:
+        with open(self.path, "rb") as f:
+            entries = [orjson.loads(line) for line in f if line.strip()]
+        # Articles finish out of order; file names carry the job counter (<cat>__<NNN>__<slug>.md)
+        return sorted(entries, key=lambda entry: int(entry["file"].split("__")[1]))
+
+
+async def write_article(args, journal: IndexJournal, job: Tuple[int, str, str], article: KBArticle, dt: Optional[float]) -> dict:
+    counter, cat, topic = job
+    slug = slugify(article.title)
+    fname = f"{cat}__{counter:03d}__{slug}.md"
+    path = os.path.join(args.outdir, fname)
+
+    async with aiofiles.open(path, "w", encoding="utf-8") as f:
+        await f.write(article.markdown.strip() + "\n")
+
+    entry = {
+        "file": fname,
+        "title": article.title,
+        "category": article.category,
+        "tags": article.tags,
+        "seed_topic": topic,
+        "model": args.model,
+        "generated_at_unix": int(time.time()),
+        "gen_seconds": round(dt, 3) if dt is not None else None,
+    }
+    await journal.append(entry)
+
+    print(f"[OK] {fname}" + (f" ({dt:.2f}s)" if dt is not None else ""))
+    return entry
+
+
+async def run_job(client: AsyncOpenAI, sem: asyncio.Semaphore, args, journal: IndexJournal, job: Tuple[int, str, str]) -> dict:
+    counter, cat, topic = job
+    async with sem:
+        print(f"[GEN {counter:03d}/{args.total}] {cat}: {topic}")
+        t0 = time.time()
+        article = await generate_one(client, args.model, cat, topic)
+        dt = time.time() - t0
+
+    return await write_article(args, journal, job, article, dt)
+
+
+async def main_async(args, journal: IndexJournal, jobs: List[Tuple[int, str, str]]) -> None:
+    client = make_client(args.concurrency)
+    # Calls are network-bound: run up to --concurrency at once, backing off on 429s/timeouts
+    sem = asyncio.Semaphore(args.concurrency)
+    results = await asyncio.gather(*(run_job(client, sem, args, journal, job) for job in jobs), return_exceptions=True)
+
+    for (counter, cat, topic), result in zip(jobs, results):
+        if isinstance(result, Exception):
+            print(f"[FAIL {counter:03d}] {cat}: {topic}: {result}")
+
+
+# -------- Batch API --------
+BATCH_MIN_TOTAL = 10  # smaller runs aren't worth the batch queueing delay
+BATCH_TERMINAL = {"completed", "failed", "expired", "cancelled"}
+
+
+def batch_custom_id(job: Tuple[int, str, str]) -> str:
+    counter, cat, _ = job
+    return f"{cat}__{counter:03d}"
+
+
+def build_batch_jsonl(model: str, jobs: List[Tuple[int, str, str]]) -> bytes:
+    response_format = {
+        "type": "json_schema",
+        "json_schema": {"name": "KBArticle", "schema": KBArticle.model_json_schema()},
+    }
+    lines = []
+    for job in jobs:
+        _, cat, topic = job
+        lines.append(orjson.dumps({
+            "custom_id": batch_custom_id(job),
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": model,
+                "messages": build_prompt(cat, topic),
+                "response_format": response_format,
+            },
+        }))
+    return b"\n".join(lines) + b"\n"
+
+
+async def main_batch(args, journal: IndexJournal, jobs: List[Tuple[int, str, str]]) -> None:
+    client = make_client(args.concurrency)
+
+    upload = await client.files.create(
+        file=("kb_batch.jsonl", io.BytesIO(build_batch_jsonl(args.model, jobs))),
+        purpose="batch",
+    )
+    batch = await client.batches.create(
+        input_file_id=upload.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+    print(f"[BATCH] {batch.id} submitted ({len(jobs)} requests)")
+
+    while batch.status not in BATCH_TERMINAL:
+        await asyncio.sleep(args.poll_interval)
+        batch = await client.batches.retrieve(batch.id)
+        counts = batch.request_counts
+        print(f"[BATCH] {batch.status}" + (f" {counts.completed}/{counts.total}" if counts else ""))
+
+    # Requests that failed validation or execution only show up in the error file
+    if batch.error_file_id:
+        errors = await client.files.content(batch.error_file_id)
+        for line in errors.text.splitlines():
+            if line.strip():
+                item = orjson.loads(line)
+                print(f"[FAIL {item.get('custom_id')}] {item.get('error') or (item.get('response') or {}).get('body')}")
+
+    if not batch.output_file_id:
+        raise RuntimeError(f"Batch {batch.id} ended with status {batch.status} and no output")
+
+    # Expired or cancelled batches still deliver (and bill) the requests they finished
+    output = await client.files.content(batch.output_file_id)
+    by_id = {batch_custom_id(job): job for job in jobs}
+
+    for line in output.text.splitlines():
+        if not line.strip():
+            continue
+        item = orjson.loads(line)
+        custom_id = item.get("custom_id")
+        response = item.get("response") or {}
+        if item.get("error") or response.get("status_code") != 200:
+            print(f"[FAIL {custom_id}] {item.get('error') or response.get('body')}")
+            continue
+        # One malformed or refused completion must not abort the rest of the batch
+        try:
+            content = response["body"]["choices"][0]["message"]["content"]
+            if content is None:
+                raise ValueError("empty completion content")
+            article = KBArticle.model_validate_json(content)
+            await write_article(args, journal, by_id[custom_id], article, None)
+        except Exception as e:
+            print(f"[FAIL {custom_id}] {e}")
+
+    if batch.status != "completed":
+        counts = batch.request_counts
+        print(f"[BATCH] {batch.id} ended with status {batch.status}" + (f": {counts.completed}/{counts.total} requests completed" if counts else ""))
+
+
 def main():
     ap = argparse.ArgumentParser(description="Generate 100 KB markdown articles via OpenAI API.")
     ap.add_argument("--model", default=os.getenv("OPENAI_GEN_MODEL", "gpt-4o-mini"))
     ap.add_argument("--total", type=int, default=100)
     ap.add_argument("--categories", default="docker,nginx,fastapi,postgres,alembic,python_env,git_ci,network,linux,wsl_windows")
     ap.add_argument("--outdir", default="data/kb_docs")
-    ap.add_argument("--sleep", type=float, default=0.2)
+    ap.add_argument("--concurrency", type=int, default=8, help="max in-flight OpenAI requests")
+    ap.add_argument("--batch", action="store_true", help=f"use the Batch API (runs with --total >= {BATCH_MIN_TOTAL})")
+    ap.add_argument("--poll-interval", type=float, default=30.0, help="seconds between batch status checks")
     args = ap.parse_args()
 
     if not os.getenv("OPENAI_API_KEY"):
@@ -222,47 +426,18 @@ def main():
     plan = distribute_total(args.total, categories)
     ensure_outdir(args.outdir)
 
-    client = OpenAI()
-
-    index = []
-    counter = 0
-
-    for cat in categories:
-        topics = DEFAULT_TOPICS.get(cat, [f"Типовая проблема для {cat}"])
-        need = plan[cat]
-
-        for i in range(need):
-            topic = topics[i % len(topics)]
-            counter += 1
-            print(f"[GEN {counter:03d}/{args.total}] {cat}: {topic}")
-
-            t0 = time.time()
-            article = generate_one(client, args.model, cat, topic)
-            dt = time.time() - t0
-
-            slug = slugify(article.title)
-            fname = f"{cat}__{counter:03d}__{slug}.md"
-            path = os.path.join(args.outdir, fname)
-
-            with open(path, "w", encoding="utf-8") as f:
-                f.write(article.markdown.strip() + "\n")
-
-            index.append({
-                "file": fname,
-                "title": article.title,
-                "category": article.category,
-                "tags": article.tags,
-                "seed_topic": topic,
-                "model": args.model,
-                "generated_at_unix": int(time.time()),
-                "gen_seconds": round(dt, 3),
-            })
-
-            print(f"[OK] {fname} ({dt:.2f}s)")
-            time.sleep(args.sleep)
-
-    with open(os.path.join(args.outdir, "index.json"), "w", encoding="utf-8") as f:
-        json.dump(index, f, ensure_ascii=False, indent=2)
+    jobs = build_jobs(categories, plan)
+    journal = IndexJournal(args.outdir)
+    if args.batch and args.total >= BATCH_MIN_TOTAL:
+        asyncio.run(main_batch(args, journal, jobs))
+    else:
+        if args.batch:
+            print(f"[BATCH] --total {args.total} < {BATCH_MIN_TOTAL}: using synchronous requests instead")
+        asyncio.run(main_async(args, journal, jobs))
+
+    index = journal.read()
+    with open(os.path.join(args.outdir, "index.json"), "wb") as f:
+        f.write(orjson.dumps(index, option=orjson.OPT_INDENT_2))
 
     print(f"\nDONE. Generated {len(index)} markdown articles in: {args.outdir}/")
 
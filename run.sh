@@ -1,5 +1,7 @@
 #!/bin/bash
 # Enable venv
 source venv/bin/activate
+# Apply schema migrations
+alembic upgrade head
 # Run server
 uvicorn app.main:app --reload --host 0.0.0.0 --port 8001
@@ -0,0 +1,33 @@
+# scripts/resize_embeddings.py
+"""
+Resizes the embedding columns to the configured model's width (EMBED_DIM).
+
+Vectors of another width can't be converted, so existing chunks and cached answers
+are deleted: re-ingest the KB with reindex=true afterwards.
+
+    OPENAI_EMBED_MODEL=text-embedding-3-large python -m scripts.resize_embeddings
+"""
+from sqlalchemy import text
+
+from app.db.database import EMBED_DIM, EMBEDDING_COLUMNS, EMBEDDING_MODEL, engine
+from app.db.models import Base
+
+
+def main():
+    column_type = f"halfvec({EMBED_DIM})"
+    with engine.begin() as conn:
+        for table, column in EMBEDDING_COLUMNS:
+            print(f"Resizing {table}.{column} to {column_type} for {EMBEDDING_MODEL} (existing rows are deleted)")
+            # The HNSW indexes depend on the column type: drop them and rebuild from the model metadata
+            indexes = [index for index in Base.metadata.tables[table].indexes if column in index.columns]
+            for index in indexes:
+                conn.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+            conn.execute(text(f"DELETE FROM {table}"))
+            conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN {column} TYPE {column_type}"))
+            for index in indexes:
+                index.create(conn)
+    print("Done. Re-ingest the KB with reindex=true.")
+
+
+if __name__ == "__main__":
+    main()